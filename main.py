@@ -3,6 +3,7 @@ import os
 import sys
 from datetime import datetime
 
+import numpy as np
 from PIL import Image
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
@@ -19,24 +20,48 @@ class IVGraphicsView(QGraphicsView):
         super().__init__(*args, **kwargs)
 
         self._firstText = None
+        self._lastItemRect = None
+        self._textItem = None
+
+    def setTextItem(self, item: "IVGraphicsTextItem") -> None:
+        self._textItem = item
+
+    def _textIndexAt(self, pos: QPoint) -> int | None:
+        if self._textItem is None:
+            return None
+
+        return self._textItem.indexAt(self._textItem.mapFromScene(self.mapToScene(pos)))
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
         self.parent().clearSelectedText.emit()
 
-        item = self.itemAt(event.pos())
-        if isinstance(item, IVGraphicsRectItem):
-            self._firstText = item
+        self._lastItemRect = None
+
+        self._firstText = self._textIndexAt(event.pos())
 
         event.accept()
 
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
-        item = self.itemAt(event.pos())
-        if isinstance(item, IVGraphicsRectItem):
+        # Nothing changes while the pointer stays inside the last hovered word.
+        if self._lastItemRect is not None and self._lastItemRect.contains(
+            self.mapToScene(event.pos())
+        ):
+            event.accept()
+            return
+
+        index = self._textIndexAt(event.pos())
+        if index is not None:
+            self._lastItemRect = self._textItem.mapRectToScene(
+                self._textItem.textRect(index)
+            )
+
             self.setCursor(Qt.CursorShape.IBeamCursor)
 
-            if self._firstText:
-                self.parent().setSelectedText.emit(self._firstText, item)
+            if self._firstText is not None:
+                self.parent().setSelectedText.emit(self._firstText, index)
         else:
+            self._lastItemRect = None
+
             self.setCursor(Qt.CursorShape.ArrowCursor)
 
         event.accept()
@@ -48,32 +73,163 @@ class IVGraphicsView(QGraphicsView):
 
     def clearFirstText(self) -> None:
         self._firstText = None
+        self._lastItemRect = None
 
 
-class IVGraphicsRectItem(QGraphicsRectItem):
-    _selectedColor = QColor(100, 167, 255, 50)
+class IVGraphicsTextItem(QGraphicsItem):
+    _selectedBrush = QBrush(QColor(100, 167, 255, 50))
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
-        self._isSelected = False
+        # Needed for option.exposedRect in paint().
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+        self._selection = None
+
+        self.setText(ocr.TextTable.from_rows([]))
+
+    def setText(self, text: ocr.TextTable) -> None:
+        self.prepareGeometryChange()
 
-    def setTextObject(self, value: ocr.Text) -> None:
-        self.setData(0, value)
+        self._text = text
+        self._selection = None
 
-    def getTextObject(self) -> ocr.Text:
-        return self.data(0)
+        self._right = text.left + text.width
+        self._bottom = text.top + text.height
 
-    def setSelected(self, selected: bool) -> None:
-        self._isSelected = selected
+        # Words sorted by top, for hit-testing with a binary search.
+        self._order = np.argsort(text.top, kind="stable")
+        self._sortedTop = text.top[self._order]
+        self._maxHeight = float(text.height.max()) if len(text) else 0.0
 
-        if selected:
-            self.setBrush(self._selectedColor)
+        if len(text):
+            self._boundingRect = QRectF(
+                QPointF(float(text.left.min()), float(text.top.min())),
+                QPointF(float(self._right.max()), float(self._bottom.max())),
+            )
         else:
-            self.setBrush(Qt.GlobalColor.transparent)
+            self._boundingRect = QRectF()
+
+    def text(self) -> ocr.TextTable:
+        return self._text
+
+    def textRect(self, index: int) -> QRectF:
+        return QRectF(
+            float(self._text.left[index]),
+            float(self._text.top[index]),
+            float(self._text.width[index]),
+            float(self._text.height[index]),
+        )
+
+    def indexAt(self, point: QPointF) -> int | None:
+        x, y = point.x(), point.y()
+
+        # Only words with top in [y - max height, y] may contain the point.
+        start = np.searchsorted(self._sortedTop, y - self._maxHeight, side="left")
+        end = np.searchsorted(self._sortedTop, y, side="right")
+        candidates = self._order[start:end]
+
+        hits = candidates[
+            (y <= self._bottom[candidates])
+            & (self._text.left[candidates] <= x)
+            & (x <= self._right[candidates])
+        ]
+
+        if len(hits) == 0:
+            return None
+
+        # Like itemAt, the last added word is on top.
+        return int(hits.max())
+
+    def selection(self) -> tuple[int, int] | None:
+        return self._selection
+
+    def setSelection(self, selection: tuple[int, int] | None) -> None:
+        if selection == self._selection:
+            return
+
+        # Repaint only the area of the words whose selection may have changed.
+        ranges = [i for i in (self._selection, selection) if i is not None]
+        self.update(
+            self._rangeRect(min(i[0] for i in ranges), max(i[1] for i in ranges))
+        )
+
+        self._selection = selection
+
+    def _rangeRect(self, start: int, end: int) -> QRectF:
+        s = slice(start, end + 1)
+
+        return QRectF(
+            QPointF(float(self._text.left[s].min()), float(self._text.top[s].min())),
+            QPointF(float(self._right[s].max()), float(self._bottom[s].max())),
+        )
+
+    def boundingRect(self) -> QRectF:
+        return self._boundingRect
+
+    def paint(
+        self,
+        painter: QPainter,
+        option: QStyleOptionGraphicsItem,
+        widget: QWidget | None = None,
+    ) -> None:
+        if self._selection is None:
+            return
+
+        start, end = self._selection
+        s = slice(start, end + 1)
+
+        left, top = self._text.left[s], self._text.top[s]
+        right, bottom = self._right[s], self._bottom[s]
+
+        exposed = option.exposedRect
+        visible = (
+            (left <= exposed.right())
+            & (right >= exposed.left())
+            & (top <= exposed.bottom())
+            & (bottom >= exposed.top())
+        )
+
+        rects = list(
+            map(
+                QRectF,
+                left[visible].tolist(),
+                top[visible].tolist(),
+                self._text.width[s][visible].tolist(),
+                self._text.height[s][visible].tolist(),
+            )
+        )
+
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self._selectedBrush)
+        painter.drawRects(rects)
+
+
+class OcrWorkerSignals(QObject):
+    resultReady = pyqtSignal(int, ocr.TextTable)
+    failed = pyqtSignal(int, str)
 
-    def isSelected(self) -> bool:
-        return self._isSelected
+
+class OcrWorker(QRunnable):
+    def __init__(self, fileName: str, loadId: int) -> None:
+        super().__init__()
+
+        self._fileName = fileName
+        self._loadId = loadId
+
+        self.signals = OcrWorkerSignals()
+
+    def run(self) -> None:
+        # An exception escaping run() aborts the application.
+        try:
+            text = ocr.get_text(self._fileName)
+
+            ocr.fix_size_and_position(text)
+        except Exception as e:
+            self.signals.failed.emit(self._loadId, str(e))
+        else:
+            self.signals.resultReady.emit(self._loadId, text)
 
 
 def showFileDialog() -> str | None:
@@ -104,13 +260,17 @@ class ImageViewer(QMainWindow):
     _graphicsPixmapItem: QGraphicsPixmapItem
     _graphicScene: QGraphicsScene
     _graphicsView: IVGraphicsView
+    _imageDpi: float
+    _imageHeight: int
+    _imageWidth: int
+    _loadId: int
     _resizeLoadImage: bool
     _scale: float
-    _text: list[ocr.Text]
-    _textRectItems: list[IVGraphicsRectItem]
+    _smoothTransformationTimer: QTimer
+    _textItem: IVGraphicsTextItem
 
     clearSelectedText = pyqtSignal()
-    setSelectedText = pyqtSignal(IVGraphicsRectItem, IVGraphicsRectItem)
+    setSelectedText = pyqtSignal(int, int)
 
     def __init__(self, fileName: str) -> None:
         super().__init__()
@@ -121,6 +281,8 @@ class ImageViewer(QMainWindow):
 
         self._connectSignals()
 
+        self._loadId = 0
+
         self._loadImage(fileName)
 
         self.setCentralWidget(self._graphicsView)
@@ -162,6 +324,10 @@ class ImageViewer(QMainWindow):
 
         self._graphicsView = IVGraphicsView(self._graphicScene, self)
 
+        self._smoothTransformationTimer = QTimer(self)
+        self._smoothTransformationTimer.setSingleShot(True)
+        self._smoothTransformationTimer.setInterval(100)
+
     def _setupUi(self) -> None:
         self._addMenuBar()
         self._addTopToolbar()
@@ -170,6 +336,7 @@ class ImageViewer(QMainWindow):
     def _connectSignals(self) -> None:
         self.clearSelectedText.connect(self._clearSelectedText)
         self.setSelectedText.connect(self._setSelectedText)
+        self._smoothTransformationTimer.timeout.connect(self._updateTransformationMode)
 
     def _openFile(self) -> None:
         if fileName := showFileDialog():
@@ -195,10 +362,9 @@ class ImageViewer(QMainWindow):
 
         layout.addRow(HLine())
 
-        with Image.open(fileName) as image:
-            width, height = image.size
-
-        layout.addRow("Image size:", QLabel(f"{width} x {height} pixels"))
+        layout.addRow(
+            "Image size:", QLabel(f"{self._imageWidth} x {self._imageHeight} pixels")
+        )
 
         dialog.setLayout(layout)
 
@@ -212,6 +378,8 @@ class ImageViewer(QMainWindow):
 
         self._graphicsView.setTransform(transform)
 
+        self._deferSmoothTransformation()
+
     def _zoomIn(self) -> None:
         self._zoom(1.25)
 
@@ -220,6 +388,7 @@ class ImageViewer(QMainWindow):
 
     def _loadImage(self, fileName: str) -> None:
         self._fileName = fileName
+        self._loadId += 1
 
         self.setWindowTitle(os.path.basename(fileName))
 
@@ -229,20 +398,33 @@ class ImageViewer(QMainWindow):
 
         image = QImage(fileName)
 
+        self._imageWidth, self._imageHeight = image.width(), image.height()
+
+        # Only the header is read, the pixels are decoded by QImage.
+        with Image.open(fileName) as imageFile:
+            # Not every file has DPI metadata (e.g. JPEGs), fallback to 72.
+            dpi, _ = imageFile.info.get("dpi", (72, 72))
+            self._imageDpi = float(dpi) or 72.0
+
         self._graphicsPixmapItem = QGraphicsPixmapItem(QPixmap.fromImage(image))
-        self._graphicsPixmapItem.setTransformationMode(
-            Qt.TransformationMode.SmoothTransformation
-        )
 
         self._graphicScene.addItem(self._graphicsPixmapItem)
         self._graphicScene.setSceneRect(self._graphicsPixmapItem.sceneBoundingRect())
 
         self._scale = self._getInitScale()
 
+        self._graphicsPixmapItem.setTransformationMode(
+            self._getTransformationMode(self._scale)
+        )
+
         self._resizeLoadImage = True
 
         self._updateSize()
 
+        self._textItem = IVGraphicsTextItem()
+        self._graphicScene.addItem(self._textItem)
+        self._graphicsView.setTextItem(self._textItem)
+
         self._doOCR()
 
     def _updateSize(self) -> None:
@@ -261,56 +443,80 @@ class ImageViewer(QMainWindow):
         self.resize(minWidth, minHeight)
 
     def _doOCR(self) -> None:
-        self._text = ocr.get_text(self._fileName)
-
-        ocr.fix_size_and_position(self._text)
+        worker = OcrWorker(self._fileName, self._loadId)
+        # Emitted from the pool thread, the result is handled in one event loop turn.
+        worker.signals.resultReady.connect(
+            self._onOcrReady, Qt.ConnectionType.QueuedConnection
+        )
+        worker.signals.failed.connect(
+            self._onOcrFailed, Qt.ConnectionType.QueuedConnection
+        )
 
-        noPen = QPen()
-        noPen.setStyle(Qt.PenStyle.NoPen)
+        QThreadPool.globalInstance().start(worker)
 
-        self._textRectItems = []
+    def _onOcrReady(self, loadId: int, text: ocr.TextTable) -> None:
+        # Another image was loaded while this one was processed.
+        if loadId != self._loadId:
+            return
 
-        for i in self._text:
-            rectItem = IVGraphicsRectItem(i.left, i.top, i.width, i.height)
-            rectItem.setAcceptHoverEvents(True)
-            rectItem.setTextObject(i)
-            rectItem.setPen(noPen)
+        self._textItem.setText(text)
 
-            self._textRectItems.append(rectItem)
+    def _onOcrFailed(self, loadId: int, error: str) -> None:
+        if loadId != self._loadId:
+            return
 
-            self._graphicScene.addItem(rectItem)
+        QMessageBox.warning(self, "OCR Failed", error)
 
     def _copyTextToClipboard(self) -> None:
-        text = [i.getTextObject() for i in self._textRectItems if i.isSelected()]
+        indices = []
+        if selection := self._textItem.selection():
+            start, end = selection
+            indices = np.arange(start, end + 1)
+
+        text = self._textItem.text().take(indices)
 
         QApplication.clipboard().setText(ocr.get_plain_text(text))
 
-    def _setSelectedText(
-        self, first: IVGraphicsRectItem, second: IVGraphicsRectItem
-    ) -> None:
-        start, end = sorted(
-            [self._textRectItems.index(first), self._textRectItems.index(second)]
-        )
-        textReactItemsRange = [
-            rect for i, rect in enumerate(self._textRectItems) if start <= i <= end
-        ]
+    def _setSelectedText(self, first: int, second: int) -> None:
+        start, end = sorted([first, second])
 
-        for i in self._textRectItems:
-            i.setSelected(i in textReactItemsRange)
+        self._textItem.setSelection((start, end))
 
     def _clearSelectedText(self) -> None:
-        for i in self._textRectItems:
-            i.setSelected(False)
+        self._textItem.setSelection(None)
 
     def _getInitScale(self) -> float:
-        with Image.open(self._fileName) as image:
-            dpi, _ = image.info["dpi"]
-
         screen = QGuiApplication.primaryScreen()
 
-        return screen.logicalDotsPerInch() / math.ceil(dpi)
+        return screen.logicalDotsPerInch() / self._imageDpi
+
+    def _getTransformationMode(self, scale: float) -> Qt.TransformationMode:
+        # Smoothing has no visible effect when image pixels map 1:1 to device pixels.
+        devicePixelRatio = self._graphicsView.viewport().devicePixelRatioF()
+
+        if math.isclose(scale * devicePixelRatio, 1.0, abs_tol=1e-6):
+            return Qt.TransformationMode.FastTransformation
+
+        return Qt.TransformationMode.SmoothTransformation
+
+    def _updateTransformationMode(self) -> None:
+        scale = self._graphicsView.transform().m11()
+
+        self._graphicsPixmapItem.setTransformationMode(
+            self._getTransformationMode(scale)
+        )
+
+    def _deferSmoothTransformation(self) -> None:
+        # Resample fast while zooming or resizing, smooth once idle.
+        self._graphicsPixmapItem.setTransformationMode(
+            Qt.TransformationMode.FastTransformation
+        )
+
+        self._smoothTransformationTimer.start()
 
     def resizeEvent(self, event: QResizeEvent) -> None:
+        resizeLoadImage = self._resizeLoadImage
+
         if self._resizeLoadImage:
             self._resizeLoadImage = False
 
@@ -328,6 +534,10 @@ class ImageViewer(QMainWindow):
 
         self._graphicsView.setTransform(transform)
 
+        # The loaded image is already shown with the right mode (see _loadImage).
+        if not resizeLoadImage:
+            self._deferSmoothTransformation()
+
         event.accept()
 
 
@@ -1,11 +1,26 @@
-import csv
 import dataclasses
-from collections import defaultdict
+import functools
+import mmap
+import os
+import pickle
+import tempfile
+import threading
 from enum import Enum
-from typing import DefaultDict
 
-import pytesseract
+# Tesseract's OpenMP threading is slower than running single-threaded.
+# Must be set before libtesseract is loaded.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+import numpy as np
+import xxhash
 from PIL import Image
+from tesserocr import RIL, PyTessBaseAPI, iterate_level
+
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "preview-ocr")
+
+# Bump when the pickled format of the cached results changes.
+CACHE_VERSION = 1
 
 
 class Language(str, Enum):
@@ -13,87 +28,212 @@ class Language(str, Enum):
     eng = "eng"
 
 
-@dataclasses.dataclass
-class Text:
-    level: int
-    page: int
-    block: int
-    paragraph: int
-    line: int
-    word: int
-    left: float
-    top: float
-    width: float
-    height: float
-    conf: str
-    text: str
+@dataclasses.dataclass(slots=True)
+class TextTable:
+    level: np.ndarray
+    page: np.ndarray
+    block: np.ndarray
+    paragraph: np.ndarray
+    line: np.ndarray
+    word: np.ndarray
+    left: np.ndarray
+    top: np.ndarray
+    width: np.ndarray
+    height: np.ndarray
+    conf: np.ndarray
+    text: list[str]
 
     @classmethod
-    def from_row(cls, row: dict[str, str]) -> "Text":
+    def from_rows(cls, rows: list[tuple]) -> "TextTable":
+        # Row: level, page, block, paragraph, line, word,
+        # left, top, width, height, conf, text
+        numbers = np.array([i[:-1] for i in rows], dtype=np.float64).reshape(-1, 11)
+        numbers = numbers.T.copy()
+
+        # 32 bit is enough for pixel coordinates and halves the memory of the columns.
+        level, page, block, paragraph, line, word = numbers[:6].astype(np.int32)
+        left, top, width, height, conf = numbers[6:].astype(np.float32)
+
         return cls(
-            level=int(row["level"]),
-            page=int(row["page_num"]),
-            block=int(row["block_num"]),
-            paragraph=int(row["par_num"]),
-            line=int(row["line_num"]),
-            word=int(row["word_num"]),
-            left=float(row["left"]),
-            top=float(row["top"]),
-            width=float(row["width"]),
-            height=float(row["height"]),
-            conf=row["conf"],
-            text=row["text"],
+            level=level,
+            page=page,
+            block=block,
+            paragraph=paragraph,
+            line=line,
+            word=word,
+            left=left,
+            top=top,
+            width=width,
+            height=height,
+            conf=conf,
+            text=[i[-1] for i in rows],
+        )
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def take(self, indices: np.ndarray) -> "TextTable":
+        return TextTable(
+            level=self.level[indices],
+            page=self.page[indices],
+            block=self.block[indices],
+            paragraph=self.paragraph[indices],
+            line=self.line[indices],
+            word=self.word[indices],
+            left=self.left[indices],
+            top=self.top[indices],
+            width=self.width[indices],
+            height=self.height[indices],
+            conf=self.conf[indices],
+            text=[self.text[i] for i in indices],
+        )
+
+
+_apis: dict[str, PyTessBaseAPI] = {}
+_apis_lock = threading.Lock()
+
+
+def _get_api(lang: str) -> PyTessBaseAPI:
+    # Loading the model and language data is expensive, keep one instance per languages.
+    if lang not in _apis:
+        _apis[lang] = PyTessBaseAPI(lang=lang)
+
+    return _apis[lang]
+
+
+def _recognize(image: Image.Image, lang: str) -> TextTable:
+    api = _get_api(lang)
+    api.SetImage(image)
+    api.Recognize()
+
+    rows = []
+
+    # No iterator when nothing was recognized.
+    iterator = api.GetIterator()
+    if iterator is None:
+        api.Clear()
+
+        return TextTable.from_rows(rows)
+
+    block = paragraph = line = word = 0
+    for i in iterate_level(iterator, RIL.WORD):
+        # Non-text blocks (e.g. pictures) have no words, like Tesseract's TSV renderer.
+        if i.Empty(RIL.WORD):
+            continue
+
+        if i.IsAtBeginningOf(RIL.BLOCK):
+            block, paragraph = block + 1, 0
+        if i.IsAtBeginningOf(RIL.PARA):
+            paragraph, line = paragraph + 1, 0
+        if i.IsAtBeginningOf(RIL.TEXTLINE):
+            line, word = line + 1, 0
+        word += 1
+
+        left, top, right, bottom = i.BoundingBox(RIL.WORD)
+
+        rows.append(
+            (
+                5,  # word level, as in Tesseract's TSV output
+                1,
+                block,
+                paragraph,
+                line,
+                word,
+                left,
+                top,
+                right - left,
+                bottom - top,
+                i.Confidence(RIL.WORD),
+                i.GetUTF8Text(RIL.WORD) or "",
+            )
         )
 
+    api.Clear()
+
+    return TextTable.from_rows(rows)
+
+
+def _get_cache_key(filename: str, lang: list[str]) -> str:
+    # Only a cache key, a fast non-cryptographic hash is enough.
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            digest = xxhash.xxh3_128(m).hexdigest()
 
-def get_text(filename: str, include_empty: bool = False, lang: list[str] = ["eng", "heb"]) -> list[Text]:
-    with Image.open(filename) as image:
-        data = pytesseract.image_to_data(image, "+".join(lang))
+    return f"{digest}-{'+'.join(lang)}-v{CACHE_VERSION}"
 
-    text = map(Text.from_row, csv.DictReader(data.splitlines(), delimiter="\t"))
 
-    if not include_empty:
-        text = filter(lambda i: i.text.strip(), text)
+@functools.lru_cache(maxsize=32)
+def _get_cached_text(key: str, filename: str, lang: tuple[str, ...]) -> TextTable:
+    cache_file = os.path.join(CACHE_DIR, f"{key}.pkl")
 
-    return list(text)
+    # A missing or unreadable cache file is a miss.
+    try:
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
 
+    # PyTessBaseAPI is not thread-safe, get_text may be called from worker threads.
+    with Image.open(filename) as image, _apis_lock:
+        text = _recognize(image, "+".join(lang))
 
-def fix_size_and_position(text: list[Text]) -> None:
-    group_by_line: DefaultDict[tuple[int, int, int, int], list[Text]] = defaultdict(list)
-    for i in text:
-        group_by_line[(i.page, i.paragraph, i.block, i.line)].append(i)
+    # Best effort, write to a temporary file and rename so a cut off write never
+    # leaves a truncated cache file.
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
 
-    for group in group_by_line.values():
-        height = max(i.height for i in group)
-        top = min(i.top for i in group)
+        fd, tmp_file = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(text, f)
 
-        # prev_i = None
-        for i in group:
-            i.height = height
-            i.top = top
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+    except OSError:
+        pass
+
+    return text
+
+
+def get_text(filename: str, lang: list[str] = ["eng", "heb"]) -> TextTable:
+    text = _get_cached_text(_get_cache_key(filename, lang), filename, tuple(lang))
+
+    indices = np.flatnonzero([bool(i.strip()) for i in text.text])
+
+    # take() copies, callers (fix_size_and_position) may modify the result.
+    return text.take(indices)
+
+
+def fix_size_and_position(text: TextTable) -> None:
+    if len(text) == 0:
+        return
 
-            # if prev_i:
-                # eng
-                # prev_i.width = i.left - prev_i.left
-                # heb
-                # i.width = prev_i.left - i.left
+    # Same line words get the line's top and height.
+    lines = np.stack([text.page, text.block, text.paragraph, text.line], axis=1)
+    _, inverse = np.unique(lines, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
 
-            # prev_i = i
+    text.top = np.minimum.reduceat(text.top[order], starts)[inverse]
+    text.height = np.maximum.reduceat(text.height[order], starts)[inverse]
 
 
-def get_plain_text(text: list[Text]) -> str:
+def get_plain_text(text: TextTable) -> str:
     if len(text) == 0:
         return ""
 
     plain_text = []
 
     line = None
-    for i in text:
-        if line != i.line:
-            sep, line = "\n", i.line
+    for i_line, i_text in zip(text.line.tolist(), text.text):
+        if line != i_line:
+            sep, line = "\n", i_line
         else:
             sep = " "
 
-        plain_text += [sep, i.text]
+        plain_text += [sep, i_text]
 
     return "".join(plain_text).strip()